@@ -1,117 +1,302 @@
 import streamlit as st
 import sqlite3
+import csv
+import io
+import threading
 import pandas as pd
-import matplotlib.pyplot as plt
+import plotly.express as px
 from datetime import datetime
 
-# Database Initialization
+# Predefined expense categories
+CATEGORIES = (
+    "Food", "Transportation", "Utilities", "Entertainment",
+    "Shopping", "Healthcare", "Education", "Rent", "Miscellaneous"
+)
+
+# Bump when the schema changes; stored in the database's user_version
+SCHEMA_VERSION = 4
+
+# SQL statements, defined once so every call reuses the same text and
+# hits sqlite3's compiled-statement cache
+SQL_INSERT_EXPENSE = 'INSERT INTO expenses (amount, category, description, date) VALUES (?, ?, ?, ?)'
+SQL_UPSERT_BUDGET = 'INSERT OR REPLACE INTO budgets (category, budget_amount) VALUES (?, ?)'
+SQL_UPSERT_TOTAL_BUDGET = '''
+    INSERT INTO total_budget (id, budget_amount) VALUES (1, ?)
+    ON CONFLICT(id) DO UPDATE SET budget_amount = excluded.budget_amount
+'''
+SQL_DELETE_EXPENSE = 'DELETE FROM expenses WHERE id = ?'
+SQL_DELETE_BUDGET = 'DELETE FROM budgets WHERE category = ?'
+SQL_SELECT_TOTAL_BUDGET = 'SELECT budget_amount FROM total_budget LIMIT 1'
+SQL_SELECT_TOTAL_EXPENSES = 'SELECT total FROM total_sum'
+SQL_SELECT_BUDGETS = 'SELECT category AS Category, budget_amount AS Budget FROM budgets'
+SQL_SELECT_EXPENSES_SIGNATURE = 'SELECT COUNT(*), COALESCE(MAX(id), 0) FROM expenses'
+SQL_SELECT_EXPENSES = '''
+    SELECT id AS ID, amount AS Amount, category AS Category,
+           description AS Description, date AS Date
+    FROM expenses ORDER BY date DESC
+'''
+SQL_SELECT_SPENDING_SUMMARY = '''
+    SELECT e.category, e.total, COALESCE(b.budget_amount, 0)
+    FROM expense_totals e
+    LEFT JOIN budgets b USING (category)
+    WHERE e.total > 0
+    UNION ALL
+    SELECT NULL,
+           COALESCE((SELECT total FROM total_sum), 0),
+           COALESCE((SELECT budget_amount FROM total_budget LIMIT 1), 0)
+'''
+
+# Database Initialization (cached so the connection and DDL survive reruns; the
+# connection is shared by every session, so each call below uses its own cursor)
+@st.cache_resource
 def init_database():
-    conn = sqlite3.connect('expense_tracker.db')
+    conn = sqlite3.connect('expense_tracker.db', check_same_thread=False, cached_statements=128)
     cursor = conn.cursor()
+
+    # WAL + synchronous=NORMAL keeps commits from fsyncing on every write
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.execute('PRAGMA cache_size=-8000')
+
+    cursor.execute('PRAGMA user_version')
+    version = cursor.fetchone()[0]
+    if version < 1:
+        # Create expenses table
+        cursor.execute(''' 
+            CREATE TABLE IF NOT EXISTS expenses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                amount REAL NOT NULL,
+                category TEXT NOT NULL,
+                description TEXT,
+                date DATE NOT NULL
+            )
+        ''')
+        
+        # Create budget table
+        cursor.execute(''' 
+            CREATE TABLE IF NOT EXISTS budgets (
+                category TEXT PRIMARY KEY,
+                budget_amount REAL NOT NULL
+            )
+        ''')
+        
+        # Create a total budget table
+        cursor.execute(''' 
+            CREATE TABLE IF NOT EXISTS total_budget (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                budget_amount REAL NOT NULL
+            )
+        ''')
+        
+    if version < 2:
+        # Per-category and overall expense totals, kept current by triggers
+        cursor.execute(''' 
+            CREATE TABLE IF NOT EXISTS expense_totals (
+                category TEXT PRIMARY KEY,
+                total REAL NOT NULL
+            )
+        ''')
+        cursor.execute(''' 
+            CREATE TABLE IF NOT EXISTS total_sum (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total REAL NOT NULL
+            )
+        ''')
+        
+        # Backfill from existing expenses
+        cursor.execute('DELETE FROM expense_totals')
+        cursor.execute('''
+            INSERT INTO expense_totals (category, total)
+            SELECT category, SUM(amount) FROM expenses GROUP BY category
+        ''')
+        cursor.execute('''
+            INSERT OR REPLACE INTO total_sum (id, total)
+            SELECT 1, COALESCE(SUM(amount), 0) FROM expenses
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_exp_ins AFTER INSERT ON expenses
+            BEGIN
+                INSERT INTO expense_totals (category, total)
+                VALUES (NEW.category, NEW.amount)
+                ON CONFLICT(category) DO UPDATE SET total = total + excluded.total;
+                UPDATE total_sum SET total = total + NEW.amount;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_exp_del AFTER DELETE ON expenses
+            BEGIN
+                UPDATE expense_totals SET total = total - OLD.amount
+                WHERE category = OLD.category;
+                DELETE FROM expense_totals WHERE category = OLD.category
+                AND NOT EXISTS (SELECT 1 FROM expenses WHERE category = OLD.category);
+                UPDATE total_sum SET total = CASE
+                    WHEN EXISTS (SELECT 1 FROM expenses) THEN total - OLD.amount ELSE 0
+                END;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_exp_upd AFTER UPDATE OF amount, category ON expenses
+            BEGIN
+                UPDATE expense_totals SET total = total - OLD.amount
+                WHERE category = OLD.category;
+                DELETE FROM expense_totals WHERE category = OLD.category
+                AND NOT EXISTS (SELECT 1 FROM expenses WHERE category = OLD.category);
+                INSERT INTO expense_totals (category, total)
+                VALUES (NEW.category, NEW.amount)
+                ON CONFLICT(category) DO UPDATE SET total = total + excluded.total;
+                UPDATE total_sum SET total = total - OLD.amount + NEW.amount;
+            END
+        ''')
     
-    # Create expenses table
-    cursor.execute(''' 
-        CREATE TABLE IF NOT EXISTS expenses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            amount REAL NOT NULL,
-            category TEXT NOT NULL,
-            description TEXT,
-            date DATE NOT NULL
-        )
-    ''')
-    
-    # Create budget table
-    cursor.execute(''' 
-        CREATE TABLE IF NOT EXISTS budgets (
-            category TEXT PRIMARY KEY,
-            budget_amount REAL NOT NULL
-        )
-    ''')
+    if version < 3:
+        # Indexes for per-category lookups (also used by trg_exp_del) and date ordering
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_exp_cat_amt ON expenses (category, amount)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_exp_date ON expenses (date DESC)')
+        cursor.execute('ANALYZE')
     
-    # Create a total budget table
-    cursor.execute(''' 
-        CREATE TABLE IF NOT EXISTS total_budget (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            budget_amount REAL NOT NULL
-        )
-    ''')
+    if version < 4:
+        # Rebuild total_budget as a single-row table (id fixed at 1) so it can be upserted
+        cursor.execute('''
+            CREATE TABLE total_budget_new (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                budget_amount REAL NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            INSERT INTO total_budget_new (id, budget_amount)
+            SELECT 1, budget_amount FROM total_budget ORDER BY id DESC LIMIT 1
+        ''')
+        cursor.execute('DROP TABLE total_budget')
+        cursor.execute('ALTER TABLE total_budget_new RENAME TO total_budget')
     
-    conn.commit()
-    return conn, cursor
+    if version < SCHEMA_VERSION:
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
+    cursor.close()
+    return conn
+
+# Shared write lock (the cached connection is used by every session)
+@st.cache_resource
+def get_write_lock():
+    return threading.Lock()
+
+# Add Expenses in Bulk (rows of (amount, category, description, date), one transaction)
+def add_expenses_bulk(conn, rows):
+    with get_write_lock(), conn:
+        conn.executemany(SQL_INSERT_EXPENSE, rows)
 
 # Add Expense
-def add_expense(conn, cursor, amount, category, description, date):
-    cursor.execute('''
-        INSERT INTO expenses (amount, category, description, date) 
-        VALUES (?, ?, ?, ?)
-    ''', (amount, category, description, date))
-    conn.commit()
+def add_expense(conn, amount, category, description, date):
+    add_expenses_bulk(conn, [(amount, category, description, date)])
+
+# Set Budgets in Bulk (rows of (category, budget_amount), one transaction)
+def set_budgets_bulk(conn, rows):
+    with get_write_lock(), conn:
+        conn.executemany(SQL_UPSERT_BUDGET, rows)
 
 # Set Budget for Category
-def set_budget(conn, cursor, category, budget_amount):
-    cursor.execute('''
-        INSERT OR REPLACE INTO budgets (category, budget_amount) 
-        VALUES (?, ?)
-    ''', (category, budget_amount))
-    conn.commit()
+def set_budget(conn, category, budget_amount):
+    set_budgets_bulk(conn, [(category, budget_amount)])
 
 # Set Total Budget
-def set_total_budget(conn, cursor, budget_amount):
-    cursor.execute('''DELETE FROM total_budget''')
-    cursor.execute('''
-        INSERT INTO total_budget (budget_amount) 
-        VALUES (?)
-    ''', (budget_amount,))
-    conn.commit()
+def set_total_budget(conn, budget_amount):
+    with get_write_lock():
+        conn.execute(SQL_UPSERT_TOTAL_BUDGET, (budget_amount,))
+        conn.commit()
 
 # Get Total Budget
-def get_total_budget(cursor):
-    cursor.execute('SELECT budget_amount FROM total_budget LIMIT 1')
-    result = cursor.fetchone()
+def get_total_budget(conn):
+    result = conn.execute(SQL_SELECT_TOTAL_BUDGET).fetchone()
     return result[0] if result else 0
 
 # Get Total Expenses
-def get_total_expenses(cursor):
-    cursor.execute('SELECT SUM(amount) FROM expenses')
-    return cursor.fetchone()[0] or 0
-
-# Get Expenses by Category
-def get_expenses_by_category(cursor):
-    cursor.execute(''' 
-        SELECT category, SUM(amount) as total_amount 
-        FROM expenses 
-        GROUP BY category
-    ''')
-    return dict(cursor.fetchall())
-
-# Get Budget for Category
-def get_budget(cursor, category):
-    cursor.execute('SELECT budget_amount FROM budgets WHERE category = ?', (category,))
-    result = cursor.fetchone()
+def get_total_expenses(conn):
+    result = conn.execute(SQL_SELECT_TOTAL_EXPENSES).fetchone()
     return result[0] if result else 0
 
+# Get Spending Summary: per-category spending and budget plus the overall totals, in one query
+def get_spending_summary(conn):
+    categories, actual_spending, budgets = [], [], []
+    total_expenses = total_budget = 0
+    # conn.execute gives this call its own cursor, so streaming its rows is safe
+    for category, total, budget in conn.execute(SQL_SELECT_SPENDING_SUMMARY):
+        # The NULL-category row carries the overall totals
+        if category is None:
+            total_expenses, total_budget = total, budget
+        else:
+            categories.append(category)
+            actual_spending.append(total)
+            budgets.append(budget)
+    return categories, actual_spending, budgets, total_expenses, total_budget
+
 # Delete Expense
-def delete_expense(conn, cursor, expense_id):
-    cursor.execute('DELETE FROM expenses WHERE id = ?', (expense_id,))
-    conn.commit()
+def delete_expense(conn, expense_id):
+    with get_write_lock():
+        conn.execute(SQL_DELETE_EXPENSE, (expense_id,))
+        conn.commit()
 
 # Delete Budget
-def delete_budget(conn, cursor, category):
-    cursor.execute('DELETE FROM budgets WHERE category = ?', (category,))
-    conn.commit()
+def delete_budget(conn, category):
+    with get_write_lock():
+        conn.execute(SQL_DELETE_BUDGET, (category,))
+        conn.commit()
+
+# Get Expenses Signature (changes whenever an expense is added or deleted)
+def get_expenses_signature(conn):
+    return conn.execute(SQL_SELECT_EXPENSES_SIGNATURE).fetchone()
 
-# Export Data to CSV
-def export_expenses_to_csv(cursor):
-    cursor.execute('SELECT * FROM expenses ORDER BY date DESC')
-    expenses_df = pd.DataFrame(cursor.fetchall(), columns=['ID', 'Amount', 'Category', 'Description', 'Date'])
-    return expenses_df.to_csv(index=False)
+# Load Expenses (cached until the signature changes)
+@st.cache_data(max_entries=4)
+def load_expenses(_conn, signature):
+    return pd.read_sql_query(SQL_SELECT_EXPENSES, _conn, parse_dates=['Date'])
+
+# Export Data to CSV (streams rows from a cursor, no DataFrame needed)
+def export_expenses_to_csv(conn):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['ID', 'Amount', 'Category', 'Description', 'Date'])
+    writer.writerows(conn.execute(SQL_SELECT_EXPENSES))
+    return buffer.getvalue()
+
+# Expense Report (a fragment, so deleting an expense reruns only this block)
+@st.fragment
+def expense_report(conn):
+    # Get expenses
+    expenses_df = load_expenses(conn, get_expenses_signature(conn))
+    
+    # Display total expenses
+    total_expenses = get_total_expenses(conn)
+    st.metric("Total Expenses", f"₹{total_expenses:.2f}")
+    
+    # Show expense table
+    if not expenses_df.empty:
+        st.dataframe(
+            expenses_df,
+            hide_index=True,
+            column_config={
+                'Amount': st.column_config.NumberColumn(format="₹%.2f"),
+                'Date': st.column_config.DateColumn(format="YYYY-MM-DD"),
+            },
+        )
+        
+        # Delete an expense by ID
+        col1, col2 = st.columns([3, 1])
+        expense_id = col1.selectbox("Delete Expense (ID)", expenses_df['ID'])
+        if col2.button("Delete"):
+            delete_expense(conn, int(expense_id))
+            st.rerun(scope="fragment")
+    else:
+        st.info("No expenses found.")
 
 # Main Streamlit App
 def main():
     st.title("💰 Expense Tracker")
     
     # Initialize database
-    conn, cursor = init_database()
+    conn = init_database()
     
     # Sidebar Navigation
     menu = ["Add Expense", "Expense Report", "Budget Management", "Visualizations", "Export Data"]
@@ -121,12 +306,6 @@ def main():
     if choice == "Add Expense":
         st.subheader("Add New Expense")
         
-        # Predefined expense categories
-        categories = [
-            "Food", "Transportation", "Utilities", "Entertainment", 
-            "Shopping", "Healthcare", "Education", "Rent", "Miscellaneous"
-        ]
-        
         # Expense input form
         col1, col2 = st.columns(2)
         
@@ -134,14 +313,14 @@ def main():
             amount = st.number_input("Expense Amount (₹)", min_value=0.0, step=10.0)
         
         with col2:
-            category = st.selectbox("Expense Category", categories)
+            category = st.selectbox("Expense Category", CATEGORIES)
         
         description = st.text_input("Description (Optional)")
         expense_date = st.date_input("Expense Date", datetime.now())
         
         if st.button("Add Expense"):
             if amount > 0:
-                add_expense(conn, cursor, amount, category, description, expense_date)
+                add_expense(conn, amount, category, description, expense_date)
                 st.success("Expense Added Successfully!")
             else:
                 st.error("Please enter a valid amount")
@@ -150,29 +329,7 @@ def main():
     elif choice == "Expense Report":
         st.subheader("Expense Report")
         
-        # Get expenses
-        cursor.execute('SELECT * FROM expenses ORDER BY date DESC')
-        expenses_df = pd.DataFrame(cursor.fetchall(), 
-                                   columns=['ID', 'Amount', 'Category', 'Description', 'Date'])
-        
-        # Display total expenses
-        total_expenses = get_total_expenses(cursor)
-        st.metric("Total Expenses", f"₹{total_expenses:.2f}")
-        
-        # Show expense table
-        if not expenses_df.empty:
-            # Display expenses in table format with a delete button
-            for index, row in expenses_df.iterrows():
-                col1, col2, col3, col4 = st.columns([3, 2, 2, 1])
-                col1.text(f"₹{row['Amount']}")
-                col2.text(row['Category'])
-                col3.text(row['Description'])
-                col4.text(row['Date'])
-                if col4.button("Delete", key=row['ID']):
-                    delete_expense(conn, cursor, row['ID'])
-                    st.experimental_rerun()
-        else:
-            st.info("No expenses found.")
+        expense_report(conn)
     
     # Budget Management Section
     elif choice == "Budget Management":
@@ -182,104 +339,71 @@ def main():
         st.write("### Set Total Budget")
         total_budget = st.number_input("Total Budget (₹)", min_value=0.0, step=100.0)
         if st.button("Set Total Budget"):
-            set_total_budget(conn, cursor, total_budget)
+            set_total_budget(conn, total_budget)
             st.success("Total Budget Set Successfully!")
         
         st.write("### Set Category-wise Budget")
-        categories = [
-            "Food", "Transportation", "Utilities", "Entertainment", 
-            "Shopping", "Healthcare", "Education", "Rent", "Miscellaneous"
-        ]
-        
-        category = st.selectbox("Select Category", categories)
+        category = st.selectbox("Select Category", CATEGORIES)
         budget_amount = st.number_input("Set Budget Amount (₹)", min_value=0.0, step=100.0)
         
         if st.button("Set Category Budget"):
-            set_budget(conn, cursor, category, budget_amount)
+            set_budget(conn, category, budget_amount)
             st.success("Category Budget Set Successfully!")
         
         # Display current budgets
         st.write("### Current Budgets")
-        cursor.execute('SELECT * FROM budgets')
-        budgets_df = pd.DataFrame(cursor.fetchall(), columns=['Category', 'Budget'])
+        budgets_df = pd.read_sql_query(SQL_SELECT_BUDGETS, conn)
         if not budgets_df.empty:
             for _, row in budgets_df.iterrows():
                 col1, col2, col3 = st.columns([3, 2, 1])
                 col1.text(row['Category'])
                 col2.text(f"₹{row['Budget']:.2f}")
                 if col3.button("Delete", key=row['Category']):
-                    delete_budget(conn, cursor, row['Category'])
-                    st.experimental_rerun()
+                    delete_budget(conn, row['Category'])
+                    st.rerun()
         else:
             st.info("No budgets found.")
 
         # Display total budget
         st.write("### Total Budget")
-        total_budget = get_total_budget(cursor)
+        total_budget = get_total_budget(conn)
         st.metric("Total Budget", f"₹{total_budget:.2f}")
     
     # Visualizations Section
     elif choice == "Visualizations":
         st.subheader("Expense Visualizations")
         
-        # Pie Chart of Expenses by Category
-        expenses_by_category = get_expenses_by_category(cursor)
+        categories, actual_spending, budgets, total_expenses, total_budget = get_spending_summary(conn)
         
-        if expenses_by_category:
-            fig1, ax1 = plt.subplots()
-            ax1.pie(expenses_by_category.values(), 
-                    labels=expenses_by_category.keys(), 
-                    autopct='%1.1f%%')
-            ax1.set_title('Expenses by Category')
-            st.pyplot(fig1)
+        # Pie Chart of Expenses by Category
+        if categories:
+            st.plotly_chart(px.pie(values=actual_spending, names=categories,
+                                   title='Expenses by Category'))
         
         # Bar Chart of Budget vs Actual Spending
         st.write("### Budget vs Actual Spending")
-        categories = list(expenses_by_category.keys())
-        actual_spending = list(expenses_by_category.values())
-        budgets = [get_budget(cursor, cat) for cat in categories]
-        
-        fig2, ax2 = plt.subplots(figsize=(10, 6))
-        x = range(len(categories))
-        width = 0.35
-        
-        ax2.bar([i - width/2 for i in x], budgets, width, label='Budget', color='green')
-        ax2.bar([i + width/2 for i in x], actual_spending, width, label='Actual Spending', color='red')
-        
-        ax2.set_xlabel('Categories')
-        ax2.set_ylabel('Amount (₹)')
-        ax2.set_title('Budget vs Actual Spending')
-        ax2.set_xticks(x)
-        ax2.set_xticklabels(categories, rotation=45)
-        ax2.legend()
-        
-        st.pyplot(fig2)
+        st.bar_chart(
+            pd.DataFrame({'Budget': budgets, 'Actual Spending': actual_spending}, index=categories),
+            x_label='Categories', y_label='Amount (₹)', color=['#008000', '#ff0000'], stack=False
+        )
 
         # Bar Chart for Total Budget vs Total Expenses
         st.write("### Total Budget vs Total Expenses")
-        total_budget = get_total_budget(cursor)
-        total_expenses = get_total_expenses(cursor)
-        
-        fig3, ax3 = plt.subplots(figsize=(6, 4))
-        ax3.bar(['Total Budget', 'Total Expenses'], [total_budget, total_expenses], color=['green', 'red'])
-        ax3.set_ylabel('Amount (₹)')
-        ax3.set_title('Total Budget vs Total Expenses')
-        
-        st.pyplot(fig3)
+        st.bar_chart(
+            pd.DataFrame({'Total Budget': [total_budget], 'Total Expenses': [total_expenses]}, index=['Total']),
+            y_label='Amount (₹)', color=['#008000', '#ff0000'], stack=False
+        )
 
     # Export Data Section
     elif choice == "Export Data":
         st.subheader("Export Expense Data")
-        csv_file = export_expenses_to_csv(cursor)
+        csv_file = export_expenses_to_csv(conn)
         st.download_button(
             label="Download Expense Data",
             data=csv_file,
             file_name="expenses.csv",
             mime="text/csv"
         )
-    
-    # Close database connection
-    conn.close()
 
 if __name__ == "__main__":
     main()